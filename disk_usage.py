@@ -1,11 +1,14 @@
 import os
-import subprocess
 import json
 from prettytable import PrettyTable
 from pathlib import Path
 from datetime import datetime
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import socket
+import zlib
+import argparse
+import asyncio
+import signal
 
 # 设置日志
 logging.basicConfig(
@@ -34,6 +37,16 @@ DEFAULT_CONFIG = {
     "max_workers": 4
 }
 
+# 单个目录 du 的超时时间（秒），超时后结束 du 进程，避免卡在失效的挂载点上
+DU_TIMEOUT = 300
+
+# 分片部分结果的文件格式标识
+PARTIAL_FORMAT = "disk_monitor.partial"
+PARTIAL_VERSION = 1
+
+# 各分片结果的生成时间最多相差多少小时，超过的视为上一次运行遗留的旧结果
+PARTIAL_MAX_AGE_SPREAD_HOURS = 12
+
 def load_config():
     """加载配置文件，如果不存在则使用默认配置"""
     config_path = Path(__file__).parent / 'config.json'
@@ -45,21 +58,39 @@ def load_config():
             logger.error(f"加载配置文件失败: {e}")
     return DEFAULT_CONFIG
 
-def get_dir_size(path):
-    """获取目录大小（单位：字节）"""
+async def get_dir_size_async(path, timeout=None):
+    """异步获取目录大小（单位：字节），超时或被取消时结束 du 进程
+
+    超时返回 None（而不是 0），以便调用方把该路径标记为结果不完整。
+    """
+    if timeout is None:
+        timeout = DU_TIMEOUT
+    proc = None
     try:
-        result = subprocess.run(['du', '-sb', path], 
-                               stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE,
-                               timeout=300)  # 添加超时设置
-        if result.returncode == 0:
-            return int(result.stdout.split()[0])
-        else:
-            logger.error(f"获取目录大小失败: {path}, 错误: {result.stderr.decode()}")
-            return 0
+        proc = await asyncio.create_subprocess_exec('du', '-sb', path,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        if proc.returncode == 0:
+            return int(stdout.split()[0])
+        logger.error(f"获取目录大小失败: {path}, 错误: {stderr.decode()}")
+        return 0
+    except asyncio.TimeoutError:
+        logger.error(f"获取目录大小超时: {path}, 超过 {timeout} 秒")
+        return None
     except Exception as e:
         logger.error(f"获取目录大小异常: {path}, 错误: {str(e)}")
         return 0
+    finally:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            try:
+                # 卡在失效挂载点上的进程可能无法立即退出，不无限等待
+                await asyncio.wait_for(proc.wait(), 5)
+            except asyncio.TimeoutError:
+                logger.warning(f"du 进程未能及时退出: {path} (pid {proc.pid})")
+                # 主动关闭传输和管道，否则事件循环关闭后会在回收时报错
+                proc._transport.close()
 
 def format_size(size_bytes):
     """将字节数转换为最合适的单位"""
@@ -71,53 +102,148 @@ def format_size(size_bytes):
         index += 1
     return f"{size:.2f} {units[index]}"
 
-def analyze_path(path_config, max_workers=4):
-    """分析单个路径的磁盘使用情况"""
-    path = path_config["path"]
-    name = path_config.get("name", os.path.basename(path))
-    # 计算总容量（字节）
+def get_total_capacity(path_config):
+    """根据路径配置计算总容量（单位：字节）"""
     if "total_size_tb" in path_config:
-        total_bytes = path_config["total_size_tb"] * 1024 ** 4  # TB转换为字节
+        return path_config["total_size_tb"] * 1024 ** 4  # TB转换为字节
     elif "total_size_gb" in path_config:
-        total_bytes = path_config["total_size_gb"] * 1024 ** 3  # GB转换为字节
-    else:
-        total_bytes = 5 * 1024 ** 4  # 默认5TB
+        return path_config["total_size_gb"] * 1024 ** 3  # GB转换为字节
+    return 5 * 1024 ** 4  # 默认5TB
+
+def in_shard(dir_name, shard_index, shard_count):
+    """判断一级子目录是否属于指定分片
+
+    使用目录名的CRC32取模分配，不依赖目录列举顺序，
+    因此各主机即使看到的目录列表略有差异，分配结果也保持一致。
+    """
+    return zlib.crc32(os.fsencode(dir_name)) % shard_count == shard_index
+
+def list_directories(path, shard_index=None, shard_count=None):
+    """列出路径下的一级子目录，可只返回指定分片的部分"""
+    directories = [item for item in Path(path).iterdir() if item.is_dir()]
+    if shard_count:
+        directories = [d for d in directories if in_shard(d.name, shard_index, shard_count)]
+    return directories
+
+async def scan_directories_async(directories, max_workers=4, timeout=None):
+    """并发获取各目录大小，按完成顺序处理结果，返回 (目录名, 字节数) 列表
+
+    待扫描目录和扫描结果都经过有界队列传递：生产者在队列满时等待，
+    同时运行的 du 进程不超过 max_workers 个。任务被取消时（例如收到
+    SIGTERM），所有工作协程会被取消并结束各自的 du 进程。
+    """
+    if max_workers < 1:
+        raise ValueError(f"max_workers 必须大于 0: {max_workers}")
+    pending = asyncio.Queue(maxsize=max_workers)
+    done = asyncio.Queue(maxsize=max_workers)
     
-    warning_threshold = path_config.get("warning_threshold", 80)
+    async def produce():
+        for directory in directories:
+            await pending.put(directory)
+        for _ in range(max_workers):
+            await pending.put(None)  # 通知工作协程退出
     
-    logger.info(f"开始分析目录: {path}")
+    async def work():
+        while True:
+            directory = await pending.get()
+            if directory is None:
+                return
+            try:
+                size_bytes = await get_dir_size_async(str(directory), timeout)
+                await done.put((directory, size_bytes, None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await done.put((directory, 0, e))
     
-    # 获取所有一级子目录
+    tasks = [asyncio.create_task(produce())]
+    tasks += [asyncio.create_task(work()) for _ in range(max_workers)]
+    dir_sizes = []
     try:
-        base_path = Path(path)
-        directories = [item for item in base_path.iterdir() if item.is_dir()]
-    except Exception as e:
-        logger.error(f"读取目录 {path} 失败: {str(e)}")
-        return {
-            "name": name,
-            "path": path,
-            "error": f"读取目录失败: {str(e)}",
-            "total_bytes": 0,
-            "directories": [],
-            "total_capacity": total_bytes,
-            "usage_percent": 0,
-            "warning_threshold": warning_threshold
-        }
+        for _ in range(len(directories)):
+            directory, size_bytes, error = await done.get()
+            if error is not None:
+                logger.error(f"处理目录 {directory} 时出错: {str(error)}")
+                continue
+            if size_bytes is not None:
+                logger.debug(f"目录 {directory} 大小: {format_size(size_bytes)}")
+            dir_sizes.append((directory.name, size_bytes))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return dir_sizes
+
+def run_async(coro):
+    """在新的事件循环中运行协程，供同步调用方使用
+
+    运行期间收到 SIGTERM 时取消扫描、结束所有 du 进程，然后以 143 退出。
+    """
+    terminated = False
     
-    # 使用线程池并行获取目录大小
-    dir_sizes = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_dir = {executor.submit(get_dir_size, str(d)): d for d in directories}
-        for future in future_to_dir:
-            directory = future_to_dir[future]
-            try:
-                size_bytes = future.result()
-                dir_sizes.append((directory.name, size_bytes))
-            except Exception as e:
-                logger.error(f"处理目录 {directory} 时出错: {str(e)}")
+    async def runner():
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        
+        def on_sigterm():
+            nonlocal terminated
+            terminated = True
+            task.cancel()
+        
+        try:
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+            installed = True
+        except (NotImplementedError, RuntimeError, ValueError):
+            # 非主线程或不支持信号处理的平台
+            installed = False
+        try:
+            return await coro
+        finally:
+            if installed:
+                loop.remove_signal_handler(signal.SIGTERM)
+    
+    try:
+        return asyncio.run(runner())
+    except asyncio.CancelledError:
+        if not terminated:
+            raise
+        logger.warning("收到 SIGTERM，扫描已取消")
+        raise SystemExit(128 + signal.SIGTERM)
+
+def get_dir_size(path):
+    """获取目录大小（单位：字节）（同步接口），超时返回 None"""
+    return run_async(get_dir_size_async(path))
+
+def build_error_result(path_config, error):
+    """构建读取失败时的分析结果"""
+    path = path_config["path"]
+    return {
+        "name": path_config.get("name", os.path.basename(path)),
+        "path": path,
+        "error": error,
+        "total_bytes": 0,
+        "directories": [],
+        "total_capacity": get_total_capacity(path_config),
+        "usage_percent": 0,
+        "warning_threshold": path_config.get("warning_threshold", 80)
+    }
+
+def build_path_result(path_config, dir_sizes):
+    """根据各目录大小构建单个路径的分析结果
+
+    有目录扫描超时（大小为 None）时结果不完整，按错误处理以免低估使用率。
+    """
+    timed_out = sorted(n for n, size in dir_sizes if size is None)
+    if timed_out:
+        return build_error_result(path_config, f"结果不完整: 目录 {timed_out} 扫描超时")
+    
+    path = path_config["path"]
+    name = path_config.get("name", os.path.basename(path))
+    total_bytes = get_total_capacity(path_config)
+    warning_threshold = path_config.get("warning_threshold", 80)
     
     # 按大小排序
-    dir_sizes.sort(key=lambda x: x[1], reverse=True)
+    dir_sizes = sorted(dir_sizes, key=lambda x: x[1], reverse=True)
     
     # 计算总大小
     total_size = sum(size for _, size in dir_sizes)
@@ -149,6 +275,135 @@ def analyze_path(path_config, max_workers=4):
         "has_warning": usage_percent > warning_threshold
     }
 
+async def analyze_path_async(path_config, max_workers=4):
+    """分析单个路径的磁盘使用情况"""
+    path = path_config["path"]
+    logger.info(f"开始分析目录: {path}")
+    
+    # 获取所有一级子目录
+    try:
+        directories = list_directories(path)
+    except Exception as e:
+        logger.error(f"读取目录 {path} 失败: {str(e)}")
+        return build_error_result(path_config, f"读取目录失败: {str(e)}")
+    
+    # 并发获取目录大小
+    dir_sizes = await scan_directories_async(directories, max_workers)
+    return build_path_result(path_config, dir_sizes)
+
+async def analyze_paths_async(monitored_paths, max_workers=4):
+    """依次分析所有监控路径"""
+    return [await analyze_path_async(path_config, max_workers) for path_config in monitored_paths]
+
+def analyze_path(path_config, max_workers=4):
+    """分析单个路径的磁盘使用情况（同步接口）"""
+    return run_async(analyze_path_async(path_config, max_workers))
+
+async def scan_shard_async(monitored_paths, shard_index, shard_count, max_workers=4):
+    """只扫描分配给本分片的一级子目录，返回可序列化的部分结果"""
+    paths = []
+    for path_config in monitored_paths:
+        path = path_config["path"]
+        logger.info(f"开始分析目录: {path} (分片 {shard_index}/{shard_count})")
+        try:
+            directories = list_directories(path, shard_index, shard_count)
+        except Exception as e:
+            logger.error(f"读取目录 {path} 失败: {str(e)}")
+            paths.append({"path": path, "error": f"读取目录失败: {str(e)}"})
+            continue
+        dir_sizes = await scan_directories_async(directories, max_workers)
+        paths.append({"path": path, "directories": [[n, s] for n, s in dir_sizes]})
+    
+    return {
+        "format": PARTIAL_FORMAT,
+        "version": PARTIAL_VERSION,
+        "host": socket.gethostname(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "paths": paths
+    }
+
+def scan_shard(monitored_paths, shard_index, shard_count, max_workers=4):
+    """只扫描分配给本分片的一级子目录（同步接口）"""
+    return run_async(scan_shard_async(monitored_paths, shard_index, shard_count, max_workers))
+
+def save_partial_result(partial, output_file):
+    """以紧凑JSON写出部分结果（先写临时文件再重命名，避免聚合端读到半个文件）
+
+    使用ASCII转义输出，非UTF-8目录名（代理转义字符）也能正确写入和读回。
+    """
+    tmp_file = f"{output_file}.tmp.{os.getpid()}"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(partial, f, separators=(',', ':'))
+    os.replace(tmp_file, output_file)
+    logger.info(f"分片结果已保存到 {output_file}")
+
+def load_partial_result(partial_file):
+    """读取并校验一个部分结果文件"""
+    with open(partial_file, 'r', encoding='utf-8') as f:
+        partial = json.load(f)
+    if partial.get("format") != PARTIAL_FORMAT or partial.get("version") != PARTIAL_VERSION:
+        raise ValueError(f"不支持的分片结果格式: {partial_file}")
+    return partial
+
+def merge_partial_results(partials, monitored_paths):
+    """将多个分片的部分结果合并为与 analyze_path 相同的结构"""
+    shard_counts = {p["shard_count"] for p in partials}
+    if len(shard_counts) > 1:
+        raise ValueError(f"分片总数不一致: {sorted(shard_counts)}")
+    shard_count = shard_counts.pop() if partials else 0
+    
+    # 丢弃与最新结果相隔太久的旧分片；同一分片出现多次时使用最新的结果
+    partials = sorted(partials, key=lambda p: p["created"])
+    if partials:
+        newest = datetime.fromisoformat(partials[-1]["created"])
+        fresh = []
+        for p in partials:
+            age = newest - datetime.fromisoformat(p["created"])
+            if age.total_seconds() > PARTIAL_MAX_AGE_SPREAD_HOURS * 3600:
+                logger.warning(f"忽略过旧的分片 {p['shard_index']} ({p['host']}, {p['created']})")
+            else:
+                fresh.append(p)
+        partials = fresh
+    by_index = {}
+    for p in partials:
+        if p["shard_index"] in by_index:
+            logger.warning(f"分片 {p['shard_index']} 出现多次，将使用最新的结果")
+        by_index[p["shard_index"]] = p
+    partials = list(by_index.values())
+    
+    # 检查分片是否齐全
+    missing = sorted(set(range(shard_count)) - set(by_index))
+    if missing:
+        logger.warning(f"缺少分片 {missing}（共 {shard_count} 个），合并结果不完整")
+    
+    path_results = []
+    for path_config in monitored_paths:
+        path = path_config["path"]
+        entries = [entry for p in partials for entry in p["paths"] if entry["path"] == path]
+        errors = [entry["error"] for entry in entries if "error" in entry]
+        if not entries:
+            path_results.append(build_error_result(path_config, "没有找到该路径的分片结果"))
+            continue
+        # 分片不全或读取失败时结果不完整，按读取失败处理以免低估使用率
+        if missing:
+            path_results.append(build_error_result(path_config, f"结果不完整: 缺少分片 {missing}（共 {shard_count} 个）"))
+            continue
+        if len(entries) < shard_count:
+            path_results.append(build_error_result(path_config, f"结果不完整: 只有 {len(entries)}/{shard_count} 个分片包含该路径"))
+            continue
+        if errors:
+            path_results.append(build_error_result(path_config, errors[0]))
+            continue
+        
+        dir_sizes = {}
+        for entry in entries:
+            for dir_name, size_bytes in entry["directories"]:
+                dir_sizes[dir_name] = size_bytes
+        path_results.append(build_path_result(path_config, list(dir_sizes.items())))
+    return path_results
+
 def generate_report(path_results):
     """生成报告"""
     report_lines = []
@@ -197,28 +452,65 @@ def generate_report(path_results):
     logger.info(f"磁盘使用报告已生成")
     return "\n".join(report_lines)
 
-def main():
-    """主函数：获取磁盘使用情况并生成报告"""
+def collect_path_results(partial_files=None):
+    """获取所有监控路径的分析结果
+
+    partial_files 不为空时不扫描磁盘，而是合并各分片保存的部分结果。
+    """
     config = load_config()
     monitored_paths = config.get("monitored_paths", DEFAULT_CONFIG["monitored_paths"])
     max_workers = config.get("max_workers", DEFAULT_CONFIG["max_workers"])
     
     # 分析每个监控的路径
-    path_results = []
-    for path_config in monitored_paths:
-        result = analyze_path(path_config, max_workers)
-        path_results.append(result)
-        
-        # 记录警告信息
+    if partial_files:
+        partials = [load_partial_result(f) for f in partial_files]
+        path_results = merge_partial_results(partials, monitored_paths)
+    else:
+        path_results = run_async(analyze_paths_async(monitored_paths, max_workers))
+    
+    # 记录警告信息
+    for result in path_results:
         if result.get("has_warning", False):
             logger.warning(f"{result['name']} 磁盘使用率达到 {result['usage_percent']:.2f}%, 超过警告阈值 {result['warning_threshold']}%")
     
+    return path_results
+
+def main(partial_files=None):
+    """主函数：获取磁盘使用情况并生成报告"""
     # 生成报告
-    report = generate_report(path_results)
+    report = generate_report(collect_path_results(partial_files))
     
     return report
 
+def parse_shard(value):
+    """解析形如 "0/3" 的分片参数"""
+    try:
+        index, count = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 序号/总数，例如 0/3: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"分片序号超出范围: {value}")
+    return index, count
+
 if __name__ == "__main__":
-    report = main()
-    if report:
-        print(report)
+    parser = argparse.ArgumentParser(description="磁盘使用情况统计")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--shard", type=parse_shard, metavar="I/N",
+                       help="只扫描第 I 个分片（共 N 个）的一级子目录，需配合 --output")
+    group.add_argument("--merge", nargs="+", metavar="FILE",
+                       help="合并多个分片结果文件并生成报告")
+    parser.add_argument("--output", help="分片结果输出文件")
+    args = parser.parse_args()
+    
+    if args.shard:
+        if not args.output:
+            parser.error("--shard 需要同时指定 --output")
+        config = load_config()
+        partial = scan_shard(config.get("monitored_paths", DEFAULT_CONFIG["monitored_paths"]),
+                             args.shard[0], args.shard[1],
+                             config.get("max_workers", DEFAULT_CONFIG["max_workers"]))
+        save_partial_result(partial, args.output)
+    else:
+        report = main(args.merge)
+        if report:
+            print(report)
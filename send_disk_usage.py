@@ -3,6 +3,12 @@ import subprocess
 import logging
 import os
 import sys
+import argparse
+import gzip
+import json
+import tempfile
+import time
+import uuid
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import Header
@@ -27,6 +33,20 @@ console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 logger.addHandler(console_handler)
 
+# 报告归档默认配置
+DEFAULT_ARCHIVE_CONFIG = {
+    "dir": "reports",
+    "keep": 12
+}
+
+# 归档目录中的临时文件超过该时间（秒）仍未被重命名，视为崩溃遗留
+STALE_TMP_SECONDS = 3600
+
+# 启动时读取一次 umask，归档文件按普通 open() 创建文件时的权限写入
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+REPORT_FILE_MODE = 0o666 & ~UMASK
+
 def convert_to_html(text):
     """将纯文本转换为HTML格式"""
     lines = text.split('\n')
@@ -330,108 +350,132 @@ def send_mail(subject, content, html_content=None):
         logger.error(f"错误详情: {traceback.format_exc()}")
         return False
 
-def save_report_to_file(report, html):
-    """将报告保存到文件中，作为邮件发送失败的备份"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    # 文件名
-    text_file = f"report_{timestamp}.txt"
-    html_file = f"report_{timestamp}.html"
-    
-    # 保存文本报告
-    try:
-        with open(text_file, "w") as f:
-            f.write(report)
-        logger.info(f"文本报告已保存到 {text_file}")
-    except Exception as e:
-        logger.error(f"保存文本报告失败: {str(e)}")
-    
-    # 保存HTML报告
-    try:
-        with open(html_file, "w") as f:
-            f.write(html)
-        logger.info(f"HTML报告已保存到 {html_file}")
-    except Exception as e:
-        logger.error(f"保存HTML报告失败: {str(e)}")
-        
-    return text_file, html_file
+def get_archive_config():
+    """读取报告归档配置，配置无效时使用默认配置（归档失败不应影响发送邮件）
 
-def delete_report_files(text_file, html_file):
-    """删除报告文件"""
-    try:
-        if os.path.exists(text_file):
-            os.remove(text_file)
-            logger.info(f"已删除文本报告文件: {text_file}")
-    except Exception as e:
-        logger.error(f"删除文本报告文件失败: {str(e)}")
-        
+    相对路径的归档目录与 config.json 一样相对于脚本所在目录解析。
+    """
     try:
-        if os.path.exists(html_file):
-            os.remove(html_file)
-            logger.info(f"已删除HTML报告文件: {html_file}")
+        config = disk_usage.load_config().get("report_archive", {})
+        archive_config = {
+            "dir": config.get("dir", DEFAULT_ARCHIVE_CONFIG["dir"]),
+            "keep": max(1, int(config.get("keep", DEFAULT_ARCHIVE_CONFIG["keep"])))
+        }
     except Exception as e:
-        logger.error(f"删除HTML报告文件失败: {str(e)}")
+        logger.error(f"报告归档配置无效，使用默认配置: {str(e)}")
+        archive_config = dict(DEFAULT_ARCHIVE_CONFIG)
+    archive_config["dir"] = Path(__file__).parent / archive_config["dir"]
+    return archive_config
 
-def clean_old_report_files():
-    """清理所有旧的报告文件"""
+def write_compressed_atomic(path, data):
+    """以gzip压缩写入文件：先写同目录下的临时文件，再重命名为目标文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
     try:
-        report_files = []
-        current_dir = Path('.')
-        
-        # 查找所有report_开头的txt和html文件
-        txt_files = list(current_dir.glob('report_*.txt'))
-        html_files = list(current_dir.glob('report_*.html'))
-        report_files = txt_files + html_files
-        
-        if not report_files:
-            logger.info("没有找到旧的报告文件")
-            return
-            
-        # 删除找到的文件
-        count = 0
-        for file in report_files:
+        # mkstemp 创建的文件权限为 0600，改为按 umask 创建普通文件时的权限
+        os.fchmod(fd, REPORT_FILE_MODE)
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(filename=path.stem, mode='wb', fileobj=raw) as gz:
+                # 非UTF-8目录名以代理字符出现在报告中，转义输出而不是报错
+                gz.write(data.encode('utf-8', errors='backslashreplace'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def update_symlink(link, target):
+    """原子地将符号链接指向新的目标（相对路径）"""
+    # 临时链接名唯一，避免多个进程同时更新同一归档目录时冲突
+    tmp_link = link.with_name(f".{link.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+def rotate_archive(archive_dir, keep):
+    """只保留最近 keep 次运行的报告"""
+    timestamps = sorted({f.name[len("report_"):].split('.')[0]
+                         for f in archive_dir.glob('report_*.gz')}, reverse=True)
+    count = 0
+    for timestamp in timestamps[keep:]:
+        for file in archive_dir.glob(f'report_{timestamp}.*.gz'):
             try:
-                os.remove(file)
+                file.unlink()
                 count += 1
                 logger.debug(f"已删除旧报告文件: {file}")
             except Exception as e:
                 logger.warning(f"删除文件 {file} 失败: {str(e)}")
-        
-        logger.info(f"已清理 {count} 个旧报告文件")
-    except Exception as e:
-        logger.error(f"清理旧报告文件时出错: {str(e)}")
+    if count:
+        logger.info(f"已清理 {count} 个旧报告文件，保留最近 {keep} 次报告")
+    
+    # 清理崩溃后遗留的临时文件；只删除较旧的，以免删掉其他进程正在写入的文件
+    now = time.time()
+    for file in list(archive_dir.glob('.report_*.tmp')) + list(archive_dir.glob('.last_report*.tmp')):
+        try:
+            if now - file.lstat().st_mtime > STALE_TMP_SECONDS:
+                file.unlink()
+                logger.info(f"已删除遗留的临时文件: {file}")
+        except Exception as e:
+            logger.warning(f"删除临时文件 {file} 失败: {str(e)}")
 
-def save_last_success_report(text_file, html_file):
-    """保存最后一次成功的报告，便于历史查看"""
-    try:
-        # 复制文本报告
-        if os.path.exists(text_file):
-            with open(text_file, 'r') as src:
-                content = src.read()
-                with open('last_report.txt', 'w') as dst:
-                    dst.write(content)
-            logger.info("已保存最后一次文本报告至 last_report.txt")
-        
-        # 复制HTML报告
-        if os.path.exists(html_file):
-            with open(html_file, 'r') as src:
-                content = src.read()
-                with open('last_report.html', 'w') as dst:
-                    dst.write(content)
-            logger.info("已保存最后一次HTML报告至 last_report.html")
-    except Exception as e:
-        logger.error(f"保存最后一次报告失败: {str(e)}")
+def remove_legacy_reports():
+    """删除旧版本在当前目录留下的 report_*.txt/html 和 last_report.txt/html
 
-def main():
-    """主函数：获取磁盘使用情况并发送邮件"""
-    logger.info("开始执行磁盘监控任务")
+    这些文件已由归档目录中的报告取代，保留下来只会让人读到过期的数据。
+    """
+    current_dir = Path('.')
+    legacy_files = (list(current_dir.glob('report_*.txt')) + list(current_dir.glob('report_*.html')) +
+                    [current_dir / 'last_report.txt', current_dir / 'last_report.html'])
+    for file in legacy_files:
+        if not file.is_file() or file.is_symlink():
+            continue
+        try:
+            file.unlink()
+            logger.info(f"已删除旧版本的报告文件: {file}")
+        except Exception as e:
+            logger.warning(f"删除文件 {file} 失败: {str(e)}")
+
+def archive_report(content, html, path_results, archive_dir, keep):
+    """将本次运行的文本、HTML和JSON报告压缩写入归档目录
+
+    每个文件只写一次；全部写完后再把 last_report.* 符号链接指向本次报告，
+    最后按保留数量清理旧报告。返回归档文件路径列表。
+    """
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    json_content = json.dumps({
+        "generated": datetime.now().isoformat(timespec="seconds"),
+        "results": path_results
+    }, ensure_ascii=False, indent=2)
     
-    # 清理旧报告文件
-    clean_old_report_files()
+    files = []
+    for ext, data in (("txt", content), ("html", html), ("json", json_content)):
+        file = archive_dir / f"report_{timestamp}.{ext}.gz"
+        write_compressed_atomic(file, data)
+        files.append(file)
+    logger.info(f"报告已归档到 {archive_dir}/report_{timestamp}.*.gz")
+    
+    for file in files:
+        update_symlink(archive_dir / file.name.replace(f"report_{timestamp}", "last_report"), file.name)
+    
+    rotate_archive(archive_dir, keep)
+    return files
+
+def main(partial_files=None):
+    """主函数：获取磁盘使用情况并发送邮件
+
+    partial_files 不为空时合并各分片的部分结果，而不是在本机扫描。
+    """
+    logger.info("开始执行磁盘监控任务")
     
     try:
-        # 直接调用disk_usage模块获取报告
-        usage_report = disk_usage.main()
+        # 直接调用disk_usage模块获取分析结果并生成报告
+        path_results = disk_usage.collect_path_results(partial_files)
+        usage_report = disk_usage.generate_report(path_results)
         
         if not usage_report:
             logger.error("未能获取磁盘使用报告")
@@ -446,20 +490,20 @@ def main():
         # 转换为HTML格式
         html_content = convert_to_html(usage_report)
         
-        # 保存报告到文件（作为备份）
-        text_file, html_file = save_report_to_file(content, html_content)
-        
-        # 保存最后一次成功的报告（用于历史查看）
-        save_last_success_report(text_file, html_file)
+        # 归档报告（同时作为邮件发送失败的备份）
+        archive_config = get_archive_config()
+        try:
+            archive_report(content, html_content, path_results,
+                           archive_config["dir"], archive_config["keep"])
+            remove_legacy_reports()
+        except Exception as e:
+            logger.error(f"归档报告失败: {str(e)}")
         
         # 发送邮件
         mail_sent = send_mail(subject, content, html_content)
         
-        if mail_sent:
-            # 邮件发送成功后删除临时文件
-            delete_report_files(text_file, html_file)
-        else:
-            logger.warning("邮件发送失败，但报告已保存到文件中。请检查SMTP配置。")
+        if not mail_sent:
+            logger.warning(f"邮件发送失败，但报告已归档到 {archive_config['dir']} 目录中。请检查SMTP配置。")
         
     except Exception as e:
         logger.error(f"执行过程中出错: {str(e)}")
@@ -467,4 +511,8 @@ def main():
         logger.error(f"错误详情: {traceback.format_exc()}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="磁盘监控并发送邮件报告")
+    parser.add_argument("--merge", nargs="+", metavar="FILE",
+                        help="合并多个分片结果文件后发送报告")
+    args = parser.parse_args()
+    main(args.merge)